@@ -1,76 +1,89 @@
-import PyPDF2
-from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import A4, landscape
-from reportlab.lib.units import inch, mm
-import io
+from reportlab.lib.units import mm
 import fitz  # PyMuPDF
-import os
+import re
+
+# Exam header marker, e.g. "TEZA 12"
+_TEZA_RE = re.compile(r'TEZA\s*(\d+)', re.IGNORECASE)
+
+# Grid sheet styling
+_FONT_NAME = "helv"  # Helvetica
+_TEXT_COLOR = (0.7, 0.7, 0.7)  # Light gray
+_BORDER_COLOR = (0.5, 0.5, 0.5)  # Gray
+_BORDER_WIDTH = 0.5
+_LABEL_HEIGHT = 8  # Much smaller label space
 
 class ExamReformatter:
     def __init__(self, input_pdf_path, output_pdf_path):
         self.input_pdf = input_pdf_path
         self.output_pdf = output_pdf_path
         self.exams = {}  # Dictionary to store exam pages
+        self.exam_first_page = {}  # Exam number -> index of its first page
+        self.exam_len = {}  # Exam number -> number of pages
         # Use landscape A4
-        self.page_width = landscape(A4)[0]
-        self.page_height = landscape(A4)[1]
+        self.page_width, self.page_height = landscape(A4)
         self.grid_cols = 3
         self.grid_rows = 2
         self.margin = 10 * mm  # Smaller margins for landscape A4
+        # Cell dimensions are the same for every grid page
+        self.cell_width = (self.page_width - 2 * self.margin) / self.grid_cols
+        self.cell_height = (self.page_height - 2 * self.margin) / self.grid_rows
+        # Open the input once and reuse it for parsing and page placement
+        self._doc = fitz.open(input_pdf_path)
+        
+    def close(self):
+        """Release the input PDF document."""
+        if self._doc is not None:
+            self._doc.close()
+            self._doc = None
         
     def parse_pdf(self):
         """Parse the PDF and group pages by exam number."""
-        with open(self.input_pdf, 'rb') as file:
-            pdf_reader = PyPDF2.PdfReader(file)
+        current_exam = None
+        
+        # Iterate through all pages
+        for page_num, page in enumerate(self._doc):
+            text = page.get_text("text")
             
-            current_exam = None
+            # Look for "TEZA" followed by a number
+            teza_match = _TEZA_RE.search(text)
             
-            # Iterate through all pages
-            for page_num in range(len(pdf_reader.pages)):
-                page = pdf_reader.pages[page_num]
-                text = page.extract_text()
-                
-                # Look for "TEZA" followed by a number
-                import re
-                teza_match = re.search(r'TEZA\s*(\d+)', text, re.IGNORECASE)
-                
-                if teza_match:
-                    # Found a new exam
-                    current_exam = int(teza_match.group(1))
-                    if current_exam not in self.exams:
-                        self.exams[current_exam] = []
-                    self.exams[current_exam].append(page_num)
-                elif current_exam is not None:
-                    # This page belongs to the current exam
-                    self.exams[current_exam].append(page_num)
+            if teza_match:
+                # Found a new exam
+                current_exam = int(teza_match.group(1))
+                if current_exam not in self.exams:
+                    self.exams[current_exam] = []
+                self.exams[current_exam].append(page_num)
+            elif current_exam is not None:
+                # This page belongs to the current exam
+                self.exams[current_exam].append(page_num)
+        
+        # Summaries used while laying out the grid
+        self.exam_first_page = {n: pages[0] for n, pages in self.exams.items()}
+        self.exam_len = {n: len(pages) for n, pages in self.exams.items()}
     
-    def create_blank_page(self):
-        """Create a blank PDF page."""
-        packet = io.BytesIO()
-        c = canvas.Canvas(packet, pagesize=landscape(A4))
-        c.drawString(100, 100, " ")
-        c.showPage()
-        c.save()
-        packet.seek(0)
-        return packet
+    def create_blank_page(self, output_doc):
+        """Append a blank page to the output document."""
+        output_doc.new_page(width=self.page_width, height=self.page_height)
     
-    def create_grid_page(self, exam_numbers, page_indices, title=""):
-        """Create a page with exams in a grid layout."""
-        packet = io.BytesIO()
-        c = canvas.Canvas(packet, pagesize=landscape(A4))
+    def create_grid_page(self, output_doc, exam_numbers, page_indices, title=""):
+        """Append a page with exams in a grid layout to the output document."""
+        page = output_doc.new_page(width=self.page_width, height=self.page_height)
         
-        # Calculate cell dimensions
-        cell_width = (self.page_width - 2 * self.margin) / self.grid_cols
-        cell_height = (self.page_height - 2 * self.margin) / self.grid_rows
+        cell_width = self.cell_width
+        cell_height = self.cell_height
         
         # Add title if provided (also make this smaller)
         if title:
-            c.setFont("Helvetica", 6)
-            c.setFillColorRGB(0.7, 0.7, 0.7)  # Light gray
-            c.drawString(self.margin, self.page_height - 10, title)
+            page.insert_text((self.margin, 10), title, fontname=_FONT_NAME, fontsize=6,
+                             color=_TEXT_COLOR)
+        
+        # Image area inside a cell (minus tiny label space), same for every cell
+        img_width = cell_width - 2
+        img_height = cell_height - _LABEL_HEIGHT - 2
         
-        pdf_document = fitz.open(self.input_pdf)
-        has_content = False
+        # Collect borders and labels in one shape, styled and committed once
+        shape = page.new_shape()
         
         for idx, (exam_num, page_idx) in enumerate(zip(exam_numbers, page_indices)):
             if exam_num is None or page_idx is None:
@@ -79,57 +92,41 @@ class ExamReformatter:
             row = idx // self.grid_cols
             col = idx % self.grid_cols
             
-            # Calculate position
+            # Calculate position (fitz measures y from the top of the page)
             x = self.margin + col * cell_width
-            y = self.page_height - self.margin - (row + 1) * cell_height
+            y = self.margin + row * cell_height
             
             # Draw cell border
-            c.setStrokeColorRGB(0.5, 0.5, 0.5)  # Gray border
-            c.setLineWidth(0.5)
-            c.rect(x, y, cell_width, cell_height, stroke=1, fill=0)
+            shape.draw_rect(fitz.Rect(x, y, x + cell_width, y + cell_height))
             
             # Add exam number label - MUCH SMALLER
-            c.setFont("Helvetica", 5)  # Tiny font
-            c.setFillColorRGB(0.7, 0.7, 0.7)  # Light gray text
-            label_height = 8  # Much smaller label space
-            c.drawString(x + 2, y + cell_height - label_height + 2, f"E{exam_num}-P{page_idx - self.exams[exam_num][0] + 1}")
+            shape.insert_text((x + 2, y + _LABEL_HEIGHT - 2),
+                              f"E{exam_num}-P{page_idx - self.exam_first_page[exam_num] + 1}",
+                              fontname=_FONT_NAME, fontsize=5,  # Tiny font
+                              color=_TEXT_COLOR)
             
-            # Convert PDF page to image
-            has_content = True
-            page = pdf_document[page_idx]
+            # Place the source page filling the entire cell (minus tiny label space)
+            # No padding - use full cell space
+            img_x = x + 1  # 1 point border
+            img_y = y + _LABEL_HEIGHT + 1
             
-            # Use higher resolution for better quality
-            pix = page.get_pixmap(matrix=fitz.Matrix(2.0, 2.0))
-            img_data = pix.tobytes("png")
-            
-            # Save temporary image
-            temp_img = f"temp_exam_{exam_num}_page_{page_idx}.png"
-            with open(temp_img, "wb") as img_file:
-                img_file.write(img_data)
-            
-            try:
-                # Draw image filling the entire cell (minus tiny label space)
-                # No padding - use full cell space
-                img_x = x + 1  # 1 point border
-                img_y = y + 1
-                img_width = cell_width - 2
-                img_height = cell_height - label_height - 2
-                
-                c.drawImage(temp_img, img_x, img_y, 
-                           width=img_width, 
-                           height=img_height,
-                           preserveAspectRatio=True, mask='auto')
-            finally:
-                try:
-                    os.remove(temp_img)
-                except:
-                    pass
+            # Embedded as vector content, no rasterization needed
+            page.show_pdf_page(fitz.Rect(img_x, img_y, img_x + img_width, img_y + img_height),
+                               self._doc, page_idx, keep_proportion=True)
         
-        c.showPage()
-        c.save()
-        packet.seek(0)
-        pdf_document.close()
-        return packet, has_content
+        shape.finish(color=_BORDER_COLOR, width=_BORDER_WIDTH)
+        shape.commit()
+    
+    def _write_sheets(self, output_doc, sheets):
+        """Add the planned sheets to the output document in order."""
+        for sheet in sheets:
+            try:
+                if sheet is None:
+                    self.create_blank_page(output_doc)
+                else:
+                    self.create_grid_page(output_doc, *sheet)
+            except Exception as e:
+                print(f"Error processing sheet: {e}")
     
     def reformat_pdf(self):
         """Main method to reformat the entire PDF."""
@@ -137,15 +134,17 @@ class ExamReformatter:
         
         print(f"\nFound {len(self.exams)} exams in the PDF")
         
-        # Categorize exams by number of pages
+        # Sort exam numbers and categorize them by number of pages in one pass
+        exam_numbers = sorted(self.exams)
         one_page_exams = []
         two_page_exams = []
         three_plus_page_exams = []
         
-        for exam_num, pages in sorted(self.exams.items()):
-            if len(pages) == 1:
+        for exam_num in exam_numbers:
+            num_pages = self.exam_len[exam_num]
+            if num_pages == 1:
                 one_page_exams.append(exam_num)
-            elif len(pages) == 2:
+            elif num_pages == 2:
                 two_page_exams.append(exam_num)
             else:
                 three_plus_page_exams.append(exam_num)
@@ -154,11 +153,8 @@ class ExamReformatter:
         print(f"  2-page exams: {len(two_page_exams)}")
         print(f"  3+ page exams: {len(three_plus_page_exams)} - {three_plus_page_exams}")
         
-        # Sort exam numbers
-        exam_numbers = sorted(self.exams.keys())
-        
-        # Create output PDF
-        output_writer = PyPDF2.PdfWriter()
+        # Sheets in output order: (exam_numbers, page_indices, title), None for a blank page
+        sheets = []
         
         # Process exams in batches of 6
         batch_count = 0
@@ -173,50 +169,39 @@ class ExamReformatter:
             print(f"\nProcessing batch {batch_count}: Exams {[b for b in batch if b is not None]}")
             
             # SHEET 1: First pages (front side)
-            page_indices = []
+            front_indices = []
             for exam_num in batch:
-                if exam_num and exam_num in self.exams:
-                    page_indices.append(self.exams[exam_num][0])  # First page
+                if exam_num and exam_num in self.exam_first_page:
+                    front_indices.append(self.exam_first_page[exam_num])  # First page
                 else:
-                    page_indices.append(None)
-            
-            front_packet, _ = self.create_grid_page(batch, page_indices, f"Batch {batch_count} - First Pages")
+                    front_indices.append(None)
             
             # SHEET 1: Second pages (back side) - reversed for double-sided printing
             back_order = [
                 batch[2], batch[1], batch[0],  # First row reversed
                 batch[5], batch[4], batch[3]   # Second row reversed
             ]
-            page_indices = []
+            back_indices = []
             for exam_num in back_order:
-                if exam_num and exam_num in self.exams and len(self.exams[exam_num]) > 1:
-                    page_indices.append(self.exams[exam_num][1])  # Second page
+                if exam_num and self.exam_len.get(exam_num, 0) > 1:
+                    back_indices.append(self.exams[exam_num][1])  # Second page
                 else:
-                    page_indices.append(None)
+                    back_indices.append(None)
             
-            back_packet, has_second_pages = self.create_grid_page(back_order, page_indices, f"Batch {batch_count} - Second Pages")
+            has_second_pages = any(p is not None for p in back_indices)
             
             # Add first sheet (pages 1-2)
-            try:
-                front_reader = PyPDF2.PdfReader(front_packet)
-                output_writer.add_page(front_reader.pages[0])
-                
-                if has_second_pages:
-                    back_reader = PyPDF2.PdfReader(back_packet)
-                    output_writer.add_page(back_reader.pages[0])
-                else:
-                    # Add blank back page
-                    blank_packet = self.create_blank_page()
-                    blank_reader = PyPDF2.PdfReader(blank_packet)
-                    output_writer.add_page(blank_reader.pages[0])
-                    
-            except Exception as e:
-                print(f"Error processing batch: {e}")
-                continue
+            sheets.append((batch, front_indices, f"Batch {batch_count} - First Pages"))
+            
+            if has_second_pages:
+                sheets.append((back_order, back_indices, f"Batch {batch_count} - Second Pages"))
+            else:
+                # Add blank back page
+                sheets.append(None)
         
         # ADDITIONAL SHEETS: Third pages for exams that have them
         # Process third pages in groups of 6
-        third_page_exams = [exam for exam in exam_numbers if len(self.exams[exam]) >= 3]
+        third_page_exams = three_plus_page_exams
         
         if third_page_exams:
             print(f"\nProcessing third pages for {len(third_page_exams)} exams...")
@@ -231,31 +216,32 @@ class ExamReformatter:
                 # Create page with third pages
                 page_indices = []
                 for exam_num in batch:
-                    if exam_num and len(self.exams[exam_num]) >= 3:
+                    if exam_num and self.exam_len[exam_num] >= 3:
                         page_indices.append(self.exams[exam_num][2])  # Third page
                     else:
                         page_indices.append(None)
                 
-                third_packet, _ = self.create_grid_page(batch, page_indices, f"Third Pages - Exams {[b for b in batch if b is not None]}")
+                sheets.append((batch, page_indices, f"Third Pages - Exams {[b for b in batch if b is not None]}"))
                 
                 # Add blank back page for single-sided printing of third pages
-                blank_packet = self.create_blank_page()
-                
-                try:
-                    third_reader = PyPDF2.PdfReader(third_packet)
-                    output_writer.add_page(third_reader.pages[0])
-                    
-                    blank_reader = PyPDF2.PdfReader(blank_packet)
-                    output_writer.add_page(blank_reader.pages[0])
-                except Exception as e:
-                    print(f"Error processing third pages: {e}")
+                sheets.append(None)
+        
+        # Create output PDF
+        output_doc = fitz.open()
+        self._write_sheets(output_doc, sheets)
+        
+        # Write output PDF (fitz refuses to save a document without pages)
+        page_count = output_doc.page_count
+        if page_count == 0:
+            output_doc.close()
+            print("\nNo exams found, nothing to write")
+            return
         
-        # Write output PDF
-        with open(self.output_pdf, 'wb') as output_file:
-            output_writer.write(output_file)
+        output_doc.save(self.output_pdf, garbage=4, deflate=True)
+        output_doc.close()
         
         print(f"\nReformatted PDF saved to: {self.output_pdf}")
-        print(f"Total pages in output: {len(output_writer.pages)}")
+        print(f"Total pages in output: {page_count}")
         print("\nPrinting instructions:")
         print("1. First set of sheets: Contains pages 1 (front) and 2 (back) for all exams")
         print("   - Print double-sided (flip on short edge)")
@@ -264,6 +250,10 @@ class ExamReformatter:
         print("- Use A4 paper in landscape orientation")
         print("- Each sheet shows 6 exam pages in a 3x2 grid")
 
-# Update with your PDF filename
-reformatter = ExamReformatter('Tezat.pdf', 'output_grid_exams_A4_landscape.pdf')
-reformatter.reformat_pdf()
\ No newline at end of file
+if __name__ == "__main__":
+    # Update with your PDF filename
+    reformatter = ExamReformatter('Tezat.pdf', 'output_grid_exams_A4_landscape.pdf')
+    try:
+        reformatter.reformat_pdf()
+    finally:
+        reformatter.close()
\ No newline at end of file